@@ -8,11 +8,13 @@ import os
 import sys
 import subprocess
 from typing import Optional
+from dataclasses import dataclass
 
 from textual import work
 from rich.text import Text
 from textual.app import App, ComposeResult
 from textual.timer import Timer
+from textual.worker import get_current_worker
 from textual.binding import Binding
 from textual.message import Message
 from textual.widgets import (
@@ -32,10 +34,15 @@ from textual.containers import Vertical, Horizontal
 from textual.widgets.tree import TreeNode
 
 from context_builder.utils import (
+    KNOWN_TEXT_EXTS,
+    DEFAULT_SKIP_DIRS,
+    CompiledGitignore,
     should_ignore,
     read_gitignore,
     estimate_tokens,
     generate_output,
+    add_line_numbers,
+    _read_if_text_cached,
     is_likely_binary_file,
 )
 
@@ -48,7 +55,17 @@ FOLDER_CLOSED = '📁 '
 FILE_ICON = '📄 '
 
 
-class CheckboxFileTree(Tree[dict]):
+@dataclass(slots=True)
+class NodeData:
+    """Per-node state for CheckboxFileTree — slotted to keep large trees light."""
+
+    path: str
+    checked: bool = False
+    is_dir: bool = False
+    loaded: bool = False
+
+
+class CheckboxFileTree(Tree[NodeData]):
     """File tree with checkbox toggling and lazy loading."""
 
     class CheckChanged(Message):
@@ -60,7 +77,9 @@ class CheckboxFileTree(Tree[dict]):
         self.root_path = os.path.abspath(path)
         self.ignore_hidden = True
         self.use_gitignore = True
-        self.gitignore_rules: list[str] = []
+        self.gitignore_rules: Optional[CompiledGitignore] = None
+        # Checked file paths, maintained incrementally as checkboxes flip
+        self._checked_paths: set[str] = set()
 
     def on_mount(self) -> None:
         self.load_directory()
@@ -68,37 +87,50 @@ class CheckboxFileTree(Tree[dict]):
     def load_directory(self) -> None:
         """Reload the tree from the root path."""
         self.clear()
-        self.gitignore_rules = read_gitignore(self.root_path) if self.use_gitignore else []
-        self.root.data = {'path': self.root_path, 'checked': False, 'is_dir': True, 'loaded': True}
+        self._checked_paths.clear()
+        self.gitignore_rules = read_gitignore(self.root_path) if self.use_gitignore else None
+        self.root.data = NodeData(self.root_path, is_dir=True, loaded=True)
         self._load_children(self.root_path, self.root)
         self.root.expand()
 
     def _load_children(self, path: str, parent_node: TreeNode) -> None:
         """Load immediate children of a directory node."""
+        # Hoist per-entry lookups out of the loop
+        ignore_hidden = self.ignore_hidden
+        rules = self.gitignore_rules if self.use_gitignore else None
+        skip_dirs = DEFAULT_SKIP_DIRS
+        text_exts = KNOWN_TEXT_EXTS
+
+        # Entries carry a precomputed sort key: dirs first, case-insensitive by name
+        items: list[tuple[tuple[bool, str], str, str, bool]] = []
         try:
-            entries = os.listdir(path)
-        except (PermissionError, FileNotFoundError):
+            with os.scandir(path) as it:
+                for entry in it:
+                    name = entry.name
+                    if ignore_hidden and name.startswith('.'):
+                        continue
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if is_dir and name in skip_dirs:
+                        continue
+                    full_path = entry.path
+                    if rules and should_ignore(full_path, is_dir, rules):
+                        continue
+                    if not is_dir:
+                        # Known text extensions skip the null-byte sniff (no syscalls)
+                        ext = name.rpartition('.')[2].lower()
+                        if ext not in text_exts and is_likely_binary_file(full_path):
+                            continue
+                    items.append(((not is_dir, name.lower()), name, full_path, is_dir))
+        except OSError:
             return
 
-        items: list[tuple[str, str, bool]] = []
-        for entry in entries:
-            full_path = os.path.join(path, entry)
-            if self.ignore_hidden and entry.startswith('.'):
-                continue
-            if self.use_gitignore and self.gitignore_rules and should_ignore(full_path, self.gitignore_rules):
-                continue
-            try:
-                is_dir = os.path.isdir(full_path)
-            except OSError:
-                continue
-            if not is_dir and is_likely_binary_file(full_path):
-                continue
-            items.append((entry, full_path, is_dir))
-
-        items.sort(key=lambda x: (not x[2], x[0].lower()))
+        items.sort()
 
-        for entry_name, full_path, is_dir in items:
-            node_data = {'path': full_path, 'checked': False, 'is_dir': is_dir, 'loaded': False}
+        for _, entry_name, full_path, is_dir in items:
+            node_data = NodeData(full_path, is_dir=is_dir)
             if is_dir:
                 node = parent_node.add(entry_name, data=node_data, expand=False, allow_expand=True)
                 # Add a placeholder so the expand arrow shows
@@ -109,19 +141,19 @@ class CheckboxFileTree(Tree[dict]):
     def _on_tree_node_expanded(self, event: Tree.NodeExpanded) -> None:
         """Lazy-load children when a directory is expanded."""
         node = event.node
-        if node.data and node.data.get('is_dir') and not node.data.get('loaded'):
-            node.data['loaded'] = True
+        if node.data and node.data.is_dir and not node.data.loaded:
+            node.data.loaded = True
             # Remove placeholder
             node.remove_children()
-            self._load_children(node.data['path'], node)
+            self._load_children(node.data.path, node)
 
     def render_label(self, node: TreeNode, _base_style, style) -> Text:
         """Render checkbox prefix on each node."""
         if node.data is None:
             return Text('...')
 
-        checked = node.data.get('checked', False)
-        is_dir = node.data.get('is_dir', False)
+        checked = node.data.checked
+        is_dir = node.data.is_dir
         check_mark = CHECKED if checked else UNCHECKED
 
         if is_dir:
@@ -141,34 +173,37 @@ class CheckboxFileTree(Tree[dict]):
         node = event.node
         if node.data is None:
             return
-        new_state = not node.data.get('checked', False)
+        new_state = not node.data.checked
         self._set_checked_recursive(node, new_state)
         self.post_message(self.CheckChanged())
 
     def _set_checked_recursive(self, node: TreeNode, checked: bool) -> None:
-        """Set check state for node and all children."""
-        if node.data is not None:
-            node.data['checked'] = checked
-        # If it's a directory that hasn't been loaded yet, load it first
-        if node.data and node.data.get('is_dir') and not node.data.get('loaded'):
-            node.data['loaded'] = True
-            node.remove_children()
-            self._load_children(node.data['path'], node)
-        for child in node.children:
-            self._set_checked_recursive(child, checked)
-        node.refresh()
+        """Set check state for node and all children.
+
+        Walks iteratively with an explicit stack and refreshes the tree once
+        at the end, instead of one recursion frame and repaint per node.
+        """
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.data is not None:
+                current.data.checked = checked
+                if current.data.is_dir:
+                    # If it's a directory that hasn't been loaded yet, load it first
+                    if not current.data.loaded:
+                        current.data.loaded = True
+                        current.remove_children()
+                        self._load_children(current.data.path, current)
+                elif checked:
+                    self._checked_paths.add(current.data.path)
+                else:
+                    self._checked_paths.discard(current.data.path)
+            stack.extend(current.children)
+        self.refresh()
 
     def get_checked_files(self) -> list[str]:
         """Return list of checked file paths."""
-        files: list[str] = []
-        self._collect_checked(self.root, files)
-        return files
-
-    def _collect_checked(self, node: TreeNode, files: list[str]) -> None:
-        if node.data and node.data.get('checked') and not node.data.get('is_dir'):
-            files.append(node.data['path'])
-        for child in node.children:
-            self._collect_checked(child, files)
+        return sorted(self._checked_paths)
 
     def select_all(self) -> None:
         self._set_checked_recursive(self.root, True)
@@ -183,6 +218,9 @@ class CheckboxFileTree(Tree[dict]):
 
 FORMAT_OPTIONS = [('XML', 'xml'), ('Markdown', 'markdown'), ('Plain Text', 'plaintext')]
 
+# Rough per-file token cost of each format's wrapper (tags, fences, separators)
+FORMAT_OVERHEAD_TOKENS = {'xml': 16, 'markdown': 12, 'plaintext': 12}
+
 
 class ContextBuilderApp(App):
     """Context Builder TUI application."""
@@ -284,7 +322,11 @@ class ContextBuilderApp(App):
     def __init__(self, path: Optional[str] = None, **kwargs) -> None:
         super().__init__(**kwargs)
         self.project_path = os.path.abspath(path) if path else os.getcwd()
+        self._project_name = os.path.basename(self.project_path)
         self._update_timer: Optional[Timer] = None
+        # Per-file token counts keyed by (path, mtime_ns, line_numbers), so
+        # toggling checkboxes only tokenizes the files that changed.
+        self._file_token_cache: dict[tuple[str, int, bool], int] = {}
 
     def compose(self) -> ComposeResult:
         yield Header()
@@ -391,8 +433,7 @@ class ContextBuilderApp(App):
             return
         ext_map = {'xml': '.xml', 'markdown': '.md', 'plaintext': '.txt'}
         ext = ext_map.get(self.output_format, '.txt')
-        base_name = os.path.basename(self.project_path)
-        filename = f'{base_name}_context{ext}'
+        filename = f'{self._project_name}_context{ext}'
         filepath = os.path.join(self.project_path, filename)
         try:
             with open(filepath, 'w', encoding='utf-8') as f:
@@ -412,20 +453,32 @@ class ContextBuilderApp(App):
                 pass
         self._update_timer = self.set_timer(0.3, self._do_update)
 
-    @work(thread=True)
+    @work(thread=True, exclusive=True)
     def _do_update(self) -> None:
-        """Generate output in a worker thread."""
+        """Generate output in a worker thread.
+
+        exclusive=True flags any in-flight build as cancelled when a newer one
+        is scheduled, but the executor thread keeps running — so the result is
+        only posted after checking is_cancelled, keeping a slow stale build
+        from overwriting a fresher preview.
+        """
+        worker = get_current_worker()
         tree = self.query_one('#file-tree', CheckboxFileTree)
-        checked_files = tree.get_checked_files()
+        # Snapshot the checked set on the UI thread — a checkbox toggle during
+        # the build would otherwise mutate it mid-iteration
+        checked_files = self.call_from_thread(tree.get_checked_files)
         include_proj_tree = self.query_one('#proj-tree', Switch).value
         include_line_nums = self.query_one('#line-nums', Switch).value
         instructions_area = self.query_one('#instructions', TextArea)
         custom_instructions = instructions_area.text
 
         if not checked_files and not include_proj_tree:
-            self.call_from_thread(self._set_preview, 'Select files to build context.', 0)
+            if not worker.is_cancelled:
+                self.call_from_thread(self._set_preview, 'Select files to build context.', 0)
             return
 
+        if worker.is_cancelled:
+            return
         output = generate_output(
             file_paths=checked_files,
             output_format=self.output_format,
@@ -437,8 +490,39 @@ class ContextBuilderApp(App):
             custom_instructions=custom_instructions,
         )
 
-        tokens = estimate_tokens(output)
-        self.call_from_thread(self._set_preview, output, tokens)
+        if include_proj_tree:
+            # The tree block varies with filter toggles; tokenize the whole output
+            tokens = estimate_tokens(output)
+        else:
+            overhead = FORMAT_OVERHEAD_TOKENS.get(self.output_format, 12)
+            tokens = sum(self._tokens_for_file(path, include_line_nums) + overhead for path in checked_files)
+            if custom_instructions.strip():
+                tokens += estimate_tokens(custom_instructions.strip())
+        if not worker.is_cancelled:
+            self.call_from_thread(self._set_preview, output, tokens)
+
+    def _tokens_for_file(self, path: str, include_line_numbers: bool) -> int:
+        """Token count for one file's content, cached by path and mtime."""
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return 0
+        key = (path, mtime_ns, include_line_numbers)
+        cached = self._file_token_cache.get(key)
+        if cached is not None:
+            return cached
+
+        tokens = 0
+        try:
+            content = _read_if_text_cached(path, mtime_ns)
+        except OSError:
+            content = None
+        if content is not None:
+            if include_line_numbers:
+                content = add_line_numbers(content)
+            tokens = estimate_tokens(content)
+        self._file_token_cache[key] = tokens
+        return tokens
 
     def _set_preview(self, text: str, tokens: int) -> None:
         preview = self.query_one('#preview', TextArea)
@@ -4,11 +4,17 @@ Utility functions for Context Builder.
 Pure functions with no GUI dependencies — shared between TUI and any future interfaces.
 """
 
+import io
 import os
+import re
 import sys
+import mmap
 import traceback
 from typing import Optional
-from fnmatch import fnmatch
+from fnmatch import translate
+from functools import lru_cache
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
 
 # Attempt to import tiktoken for accurate token counting
 try:
@@ -51,150 +57,445 @@ EXT_TO_LANG: dict[str, str] = {
 DEFAULT_TOKENIZER_MODEL = 'gpt-4'
 BINARY_CHECK_CHUNK_SIZE = 1024
 
+# Below this many files a thread pool costs more than it saves
+PARALLEL_READ_THRESHOLD = 8
+
+# Cap on how much of a single file is ingested — a stray huge log should
+# not swamp the preview buffer.
+MAX_FILE_READ_BYTES = 2_000_000
+TRUNCATION_MARKER = '\n[... truncated ...]'
+
+# Files above this size are mapped instead of read into an intermediate bytes
+MMAP_READ_THRESHOLD = 64 * 1024
+
+# Translation table for XML escaping — one C-level pass instead of three
+# chained str.replace copies.
+_XML_ESCAPE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+
+
+def escape_xml(text: str) -> str:
+    """Escapes &, < and > for embedding text in XML output."""
+    return text.translate(_XML_ESCAPE)
+
+
+# Extensions that are always text — files with these skip the null-byte
+# sniff (and its open/read/close syscalls) entirely.
+KNOWN_TEXT_EXTS: frozenset[str] = frozenset(EXT_TO_LANG) | frozenset(
+    {
+        'txt',
+        'rst',
+        'cfg',
+        'ini',
+        'env',
+        'csv',
+        'tsv',
+        'log',
+        'conf',
+        'lock',
+        'svg',
+        'scss',
+        'less',
+        'lua',
+        'vue',
+        'bat',
+        'ps1',
+        'proto',
+        'graphql',
+        'gitignore',
+        'editorconfig',
+    }
+)
+
+# Heavy directories that are never worth descending into — checked by name
+# before the (more expensive) gitignore regexes are consulted.
+DEFAULT_SKIP_DIRS: frozenset[str] = frozenset(
+    {'.git', 'node_modules', '__pycache__', '.venv', 'dist', 'build', 'target', '.mypy_cache'}
+)
+
 
 def is_likely_binary_file(filepath: str, chunk_size: int = BINARY_CHECK_CHUNK_SIZE) -> bool:
     """Heuristically checks if a file is likely binary by looking for null bytes."""
     try:
         with open(filepath, 'rb') as f:
             chunk = f.read(chunk_size)
-        return b'\x00' in chunk
+        return chunk.find(b'\x00') != -1
     except (OSError, Exception):
         return True
 
 
-def should_ignore(path: str, gitignore_rules: list[str]) -> bool:
-    """Checks if a path should be ignored based on simplified .gitignore rules."""
-    basename = os.path.basename(path)
-    normalized_path = os.path.normpath(path)
-    ignored = False
-    negated_match = False
-
-    for rule in gitignore_rules:
+@dataclass(eq=False)
+class CompiledGitignore:
+    """Precompiled .gitignore rules, bucketed by rule form.
+
+    Each field is a single regex union over all rules of that form (trailing
+    slash, path-containing, or plain basename), so matching a path costs one
+    `re` call per bucket instead of one `fnmatch` call per rule.
+    """
+
+    dir_re: Optional[re.Pattern] = None
+    path_re: Optional[re.Pattern] = None
+    basename_re: Optional[re.Pattern] = None
+    neg_dir_re: Optional[re.Pattern] = None
+    neg_path_re: Optional[re.Pattern] = None
+    neg_basename_re: Optional[re.Pattern] = None
+    # Wildcard-free path rules, matched with a single str.endswith call
+    path_suffixes: tuple[str, ...] = ()
+    neg_path_suffixes: tuple[str, ...] = ()
+    # Pure '*.ext' rules, matched with a set lookup on the extension
+    basename_exts: frozenset[str] = frozenset()
+    neg_basename_exts: frozenset[str] = frozenset()
+
+    def __bool__(self) -> bool:
+        return (
+            self.dir_re is not None
+            or self.path_re is not None
+            or self.basename_re is not None
+            or bool(self.path_suffixes)
+            or bool(self.basename_exts)
+        )
+
+
+def _compile_glob_union(globs: list[str]) -> Optional[re.Pattern]:
+    """Compiles a list of glob patterns into one alternation regex."""
+    if not globs:
+        return None
+    return re.compile('|'.join(translate(g) for g in globs))
+
+
+def compile_gitignore_rules(rules: list[str]) -> CompiledGitignore:
+    """Compiles raw .gitignore rule lines into regex unions, bucketed by form.
+
+    Path rules with no glob characters — the majority in real .gitignore
+    files — are kept as plain suffixes for str.endswith instead of regexes.
+    """
+    buckets: dict[str, list[str]] = {'dir': [], 'path': [], 'basename': [], 'suffix': [], 'ext': []}
+    neg_buckets: dict[str, list[str]] = {'dir': [], 'path': [], 'basename': [], 'suffix': [], 'ext': []}
+
+    for rule in rules:
         if not rule or rule.startswith('#'):
             continue
-        is_negating = rule.startswith('!')
-        if is_negating:
+        target = buckets
+        if rule.startswith('!'):
+            target = neg_buckets
             rule = rule[1:]
 
-        match = False
         if rule.endswith('/'):
-            if os.path.isdir(normalized_path) and fnmatch(basename, rule.rstrip('/')):
-                match = True
+            target['dir'].append(rule.rstrip('/'))
         elif '/' in rule:
-            if fnmatch(normalized_path, '*' + rule.replace('/', os.sep)):
-                match = True
+            native = rule.replace('/', os.sep)
+            if any(ch in rule for ch in '*?['):
+                target['path'].append('*' + native)
+            else:
+                target['suffix'].append(native)
+        elif rule.startswith('*.') and not any(ch in rule[2:] for ch in '*?[.'):
+            target['ext'].append(rule[2:])
         else:
-            if fnmatch(basename, rule):
-                match = True
+            target['basename'].append(rule)
+
+    return CompiledGitignore(
+        dir_re=_compile_glob_union(buckets['dir']),
+        path_re=_compile_glob_union(buckets['path']),
+        basename_re=_compile_glob_union(buckets['basename']),
+        neg_dir_re=_compile_glob_union(neg_buckets['dir']),
+        neg_path_re=_compile_glob_union(neg_buckets['path']),
+        neg_basename_re=_compile_glob_union(neg_buckets['basename']),
+        path_suffixes=tuple(buckets['suffix']),
+        neg_path_suffixes=tuple(neg_buckets['suffix']),
+        basename_exts=frozenset(buckets['ext']),
+        neg_basename_exts=frozenset(neg_buckets['ext']),
+    )
+
+
+@lru_cache(maxsize=8192)
+def should_ignore(path: str, is_dir: bool, gitignore_rules: Optional[CompiledGitignore]) -> bool:
+    """Checks if a path should be ignored based on precompiled .gitignore rules.
+
+    `is_dir` is supplied by the caller (which already knows it from directory
+    listing) so directory rules never need an extra stat call here. Results
+    are memoized — tree reloads and repeated walks re-test the same paths
+    against the same (cached) compiled rules, so hits are near-free.
+    """
+    if not gitignore_rules:
+        return False
+    basename = os.path.basename(path)
+    normalized_path = os.path.normpath(path)
+    rules = gitignore_rules
+
+    matched = bool(
+        (rules.basename_exts and '.' in basename and basename.rpartition('.')[2] in rules.basename_exts)
+        or (rules.basename_re and rules.basename_re.match(basename))
+        or (rules.path_suffixes and normalized_path.endswith(rules.path_suffixes))
+        or (rules.path_re and rules.path_re.match(normalized_path))
+        or (rules.dir_re and is_dir and rules.dir_re.match(basename))
+    )
+    if not matched:
+        return False
+
+    negated = bool(
+        (rules.neg_basename_exts and '.' in basename and basename.rpartition('.')[2] in rules.neg_basename_exts)
+        or (rules.neg_basename_re and rules.neg_basename_re.match(basename))
+        or (rules.neg_path_suffixes and normalized_path.endswith(rules.neg_path_suffixes))
+        or (rules.neg_path_re and rules.neg_path_re.match(normalized_path))
+        or (rules.neg_dir_re and is_dir and rules.neg_dir_re.match(basename))
+    )
+    return not negated
+
+
+@lru_cache(maxsize=32)
+def _read_gitignore_cached(gitignore_path: str, _mtime_ns: int) -> CompiledGitignore:
+    """Parses and compiles a .gitignore file, cached by path and mtime."""
+    rules: list[str] = []
+    try:
+        with open(gitignore_path, 'r', encoding='utf-8') as f:
+            rules = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    except (OSError, UnicodeDecodeError) as e:
+        print(f'Warning: Could not read .gitignore: {e}', file=sys.stderr)
+    return compile_gitignore_rules(rules)
 
-        if match:
-            if is_negating:
-                ignored = False
-                negated_match = True
-            elif not negated_match:
-                ignored = True
-    return ignored
 
+def read_gitignore(directory_path: str) -> CompiledGitignore:
+    """Reads a .gitignore file and returns its rules precompiled.
 
-def read_gitignore(directory_path: str) -> list[str]:
-    """Reads and parses a .gitignore file."""
+    Results are cached by the file's mtime, so repeated reloads (e.g. from
+    toggling filters) skip both the parse and the regex compilation.
+    """
     gitignore_path = os.path.join(directory_path, '.gitignore')
-    rules: list[str] = []
-    if os.path.isfile(gitignore_path):
-        try:
-            with open(gitignore_path, 'r', encoding='utf-8') as f:
-                rules = [line.strip() for line in f if line.strip() and not line.startswith('#')]
-        except (OSError, UnicodeDecodeError) as e:
-            print(f'Warning: Could not read .gitignore: {e}', file=sys.stderr)
-    return rules
+    try:
+        mtime_ns = os.stat(gitignore_path).st_mtime_ns
+    except OSError:
+        return compile_gitignore_rules([])
+    return _read_gitignore_cached(gitignore_path, mtime_ns)
 
 
 def add_line_numbers(content: str) -> str:
     """Prepends line numbers to each line of a string."""
-    lines = content.splitlines()
+    if '\r' in content:
+        # Normalise CRLF/CR so split('\n') matches splitlines(); one C-level
+        # pass, and the common LF-only case skips it entirely
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+    lines = content.split('\n')
+    if lines and lines[-1] == '':
+        lines.pop()
     if not lines:
         return ''
     padding = len(str(len(lines)))
-    return '\n'.join(f'{i + 1:<{padding}} | {line}' for i, line in enumerate(lines))
+    # Bind the format once — an f-string with a dynamic width spec re-parses
+    # the spec on every line.
+    fmt = ('{:<' + str(padding) + '} | {}').format
+    return '\n'.join(fmt(i, line) for i, line in enumerate(lines, 1))
+
+
+@lru_cache(maxsize=4)
+def _get_encoder(model: str):
+    """Returns the tiktoken encoding for a model, cached across calls."""
+    return tiktoken.encoding_for_model(model)
+
 
+def estimate_tokens(text: str | list[str], model: str = DEFAULT_TOKENIZER_MODEL) -> int:
+    """Estimates token count using tiktoken or character approximation.
 
-def estimate_tokens(text: str, model: str = DEFAULT_TOKENIZER_MODEL) -> int:
-    """Estimates token count using tiktoken or character approximation."""
+    Accepts a single string or a list of chunks; chunks are encoded in one
+    batch so tiktoken can spread the work across its internal thread pool.
+    """
+    chunks = [text] if isinstance(text, str) else text
     if TIKTOKEN_AVAILABLE:
         try:
-            enc = tiktoken.encoding_for_model(model)
-            return len(enc.encode(text))
+            enc = _get_encoder(model)
+            return sum(map(len, enc.encode_ordinary_batch(chunks, num_threads=os.cpu_count() or 1)))
         except (KeyError, Exception):
             pass
-    return len(text) // 4
+    return sum(len(chunk) for chunk in chunks) // 4
 
 
 def generate_project_tree(
     path: str,
-    prefix: str = '',
     ignore_hidden: bool = True,
-    gitignore_rules: Optional[list[str]] = None,
+    gitignore_rules: Optional[CompiledGitignore] = None,
 ) -> list[str]:
-    """Generates a text tree representation of a directory."""
-    if gitignore_rules is None:
-        gitignore_rules = []
+    """Generates a text tree representation of a directory.
+
+    Uses a single os.walk(topdown=True) pass, pruning ignored directories
+    in place so excluded subtrees are never visited, then renders the
+    connector lines with an explicit stack (no Python recursion).
+    """
+    children: dict[str, list[tuple[str, bool]]] = {}
+    for dirpath, dirnames, filenames in os.walk(path, topdown=True):
+        kept_dirs = [
+            name
+            for name in dirnames
+            if not (ignore_hidden and name.startswith('.'))
+            and name not in DEFAULT_SKIP_DIRS
+            and not (gitignore_rules and should_ignore(os.path.join(dirpath, name), True, gitignore_rules))
+        ]
+        dirnames[:] = kept_dirs
+
+        # Precomputed sort keys: dirs first, then case-insensitive by name
+        keyed = [((False, name.lower()), name, True) for name in kept_dirs]
+        for name in filenames:
+            if ignore_hidden and name.startswith('.'):
+                continue
+            if gitignore_rules and should_ignore(os.path.join(dirpath, name), False, gitignore_rules):
+                continue
+            keyed.append(((True, name.lower()), name, False))
+        keyed.sort()
+        children[dirpath] = [(name, is_dir) for _, name, is_dir in keyed]
+
     tree_lines: list[str] = []
-    try:
-        entries = os.listdir(path)
-    except (PermissionError, FileNotFoundError):
-        return tree_lines
-
-    filtered_entries: list[tuple[str, str, bool]] = []
-    for entry in entries:
-        full_path = os.path.join(path, entry)
-        if ignore_hidden and entry.startswith('.'):
+    # Each frame is [entries, next_index, prefix, dirpath].
+    stack: list[list] = [[children.get(path, []), 0, '', path]]
+    while stack:
+        frame = stack[-1]
+        entries, i, prefix, dirpath = frame
+        if i >= len(entries):
+            stack.pop()
             continue
-        if gitignore_rules and should_ignore(full_path, gitignore_rules):
-            continue
-        try:
-            is_dir = os.path.isdir(full_path)
-            filtered_entries.append((entry, full_path, is_dir))
-        except OSError:
-            continue
-
-    filtered_entries.sort(key=lambda x: (not x[2], x[0].lower()))
-
-    entry_count = len(filtered_entries)
-    for i, (entry_name, full_path, is_dir) in enumerate(filtered_entries):
-        is_last = i == (entry_count - 1)
+        frame[1] = i + 1
+        entry_name, is_dir = entries[i]
+        is_last = i == (len(entries) - 1)
         connector = '└── ' if is_last else '├── '
         tree_lines.append(f'{prefix}{connector}{entry_name}')
         if is_dir:
+            full_path = os.path.join(dirpath, entry_name)
             next_prefix = prefix + ('    ' if is_last else '│   ')
-            tree_lines.extend(generate_project_tree(full_path, next_prefix, ignore_hidden, gitignore_rules))
+            stack.append([children.get(full_path, []), 0, next_prefix, full_path])
     return tree_lines
 
 
-def generate_output(
+def read_if_text(path: str, max_bytes: int = MAX_FILE_READ_BYTES) -> Optional[str]:
+    """Reads a file's text content, or None if it looks binary.
+
+    Sniffs the first chunk for null bytes and reads the remainder from the
+    same descriptor with fstat-sized os.read calls, so a text file costs one
+    open instead of a sniff-open plus a content-open, and the read bypasses
+    the buffered-IO layer entirely. Large files are mmapped so the sniff and
+    decode work straight off the page cache with no intermediate bytes copy.
+    Files larger than `max_bytes` are cut off with a truncation marker.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        if size > MMAP_READ_THRESHOLD:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                if mm.find(b'\x00', 0, BINARY_CHECK_CHUNK_SIZE) != -1:
+                    return None
+                data = mm[: min(size, max_bytes)]
+        else:
+            head = os.read(fd, BINARY_CHECK_CHUNK_SIZE)
+            if head.find(b'\x00') != -1:
+                return None
+            parts = [head]
+            remaining = min(size, max_bytes) - len(head)
+            while remaining > 0:
+                chunk = os.read(fd, remaining)
+                if not chunk:
+                    break
+                parts.append(chunk)
+                remaining -= len(chunk)
+            data = parts[0] if len(parts) == 1 else b''.join(parts)
+    finally:
+        os.close(fd)
+    text = data.decode('utf-8', errors='replace')
+    return text + TRUNCATION_MARKER if size > max_bytes else text
+
+
+@lru_cache(maxsize=256)
+def _read_if_text_cached(path: str, _mtime_ns: int) -> Optional[str]:
+    """read_if_text cached by (path, mtime), so re-renders skip unchanged files."""
+    return read_if_text(path)
+
+
+def _read_one(file_path: str) -> tuple[str, Optional[str]]:
+    """Reads one file for output assembly; content is None for binary or unreadable files."""
+    try:
+        mtime_ns = os.stat(file_path).st_mtime_ns
+        return file_path, _read_if_text_cached(file_path, mtime_ns)
+    except OSError as e:
+        print(f'Warning: Error processing file {file_path}: {e}', file=sys.stderr)
+        return file_path, None
+
+
+_io_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _get_io_pool() -> ThreadPoolExecutor:
+    """Returns the shared file-read pool, created lazily on first use."""
+    global _io_pool
+    if _io_pool is None:
+        max_workers = min(32, (os.cpu_count() or 4) * 4)
+        _io_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ctx-read')
+    return _io_pool
+
+
+def _read_all(file_paths: list[str]) -> dict[str, Optional[str]]:
+    """Reads many files, fanning out to threads when the batch is large.
+
+    The GIL is released during read() syscalls, so threads overlap the
+    per-file open/read latency on large selections.
+    """
+    if len(file_paths) < PARALLEL_READ_THRESHOLD:
+        return dict(map(_read_one, file_paths))
+    return dict(_get_io_pool().map(_read_one, file_paths))
+
+
+def _format_file_plaintext(rel_path: str, content: str) -> str:
+    return f'--- File: {rel_path} ---\n{content}\n--- End File ---\n\n'
+
+
+def _format_file_xml(rel_path: str, content: str) -> str:
+    file_ext = os.path.splitext(rel_path)[1].lstrip('.')
+    return f'<file path="{escape_xml(rel_path)}" type="{escape_xml(file_ext)}">\n{escape_xml(content)}\n</file>\n'
+
+
+def _format_file_markdown(rel_path: str, content: str) -> str:
+    lang = EXT_TO_LANG.get(rel_path.rpartition('.')[2].lower(), '')
+    return f'**File:** `{rel_path}`\n```{lang}\n{content}\n```\n\n'
+
+
+_FILE_FORMATTERS = {
+    'plaintext': _format_file_plaintext,
+    'xml': _format_file_xml,
+    'markdown': _format_file_markdown,
+}
+
+
+@lru_cache(maxsize=256)
+def _render_file(
+    rel_path: str,
+    output_format: str,
+    include_line_numbers: bool,
+    content: str,
+) -> Optional[str]:
+    """Renders one file's content into its formatted output chunk.
+
+    Keyed on the content itself: when the read cache serves back an unchanged
+    file, rebuilds after a checkbox toggle skip re-numbering and re-escaping.
+    """
+    formatter = _FILE_FORMATTERS.get(output_format)
+    if formatter is None:
+        return None
+    if include_line_numbers:
+        content = add_line_numbers(content)
+    return formatter(rel_path, content)
+
+
+def _iter_output(
     file_paths: list[str],
     output_format: str,
     include_line_numbers: bool,
     include_project_tree: bool,
     base_dir: Optional[str],
-    ignore_hidden: bool = True,
-    gitignore_rules: Optional[list[str]] = None,
-    custom_instructions: str = '',
-) -> str:
-    """Generates the final context string."""
-    if gitignore_rules is None:
-        gitignore_rules = []
-    result_lines: list[str] = []
-
-    def escape_xml(text: str) -> str:
-        return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-
+    ignore_hidden: bool,
+    gitignore_rules: Optional[CompiledGitignore],
+    custom_instructions: str,
+):
+    """Yields newline-terminated fragments of the final context output."""
     # Add custom instructions before context
     if custom_instructions.strip():
-        result_lines.append(custom_instructions.strip())
-        result_lines.append('')
+        yield custom_instructions.strip() + '\n'
+        yield '\n'
 
     if output_format == 'xml':
-        result_lines.append('<context>')
+        yield '<context>\n'
 
     # Project structure tree
     if include_project_tree and base_dir:
@@ -203,60 +504,85 @@ def generate_output(
         full_tree_text = base_dir_name + '\n' + '\n'.join(tree_lines)
 
         if output_format == 'xml':
-            result_lines.extend(['<projectTree>', escape_xml(full_tree_text), '</projectTree>'])
+            yield '<projectTree>\n'
+            yield escape_xml(full_tree_text) + '\n'
+            yield '</projectTree>\n'
         elif output_format == 'markdown':
-            result_lines.extend(['**Project Structure:**', '```', full_tree_text, '```'])
+            yield '**Project Structure:**\n```\n'
+            yield full_tree_text + '\n'
+            yield '```\n'
         else:
-            result_lines.extend(['--- Project Structure ---', full_tree_text, '--- End Structure ---'])
-        result_lines.append('')
+            yield '--- Project Structure ---\n'
+            yield full_tree_text + '\n'
+            yield '--- End Structure ---\n'
+        yield '\n'
 
     # File contents
     if file_paths:
         if output_format == 'xml':
-            result_lines.append('<files>')
+            yield '<files>\n'
         elif output_format in ['markdown', 'plaintext']:
-            result_lines.extend(['--- Files ---', ''])
+            yield '--- Files ---\n\n'
 
-        for file_path in sorted(file_paths):
-            if is_likely_binary_file(file_path):
-                continue
+        sorted_paths = sorted(file_paths)
+        # Parallel reads, consumed directly — no round-trip through the LRU,
+        # which selections larger than its capacity would evict before use
+        contents = _read_all(sorted_paths)
+
+        # Hoist per-file lookups out of the loop
+        abspath = os.path.abspath
+        relpath = os.path.relpath
+        render = _render_file
+        abs_base_dir = abspath(base_dir) if base_dir else None
+        base_prefix = abs_base_dir + os.sep if abs_base_dir else None
 
+        for file_path in sorted_paths:
             try:
+                content = contents.get(file_path)
+                if content is None:
+                    continue
                 rel_path = file_path
-                abs_base_dir = os.path.abspath(base_dir) if base_dir else None
-                abs_file_path = os.path.abspath(file_path)
-                if abs_base_dir and abs_file_path.startswith(abs_base_dir + os.sep):
-                    rel_path = os.path.relpath(abs_file_path, abs_base_dir)
-
-                with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-                    content = f.read()
-                if include_line_numbers:
-                    content = add_line_numbers(content)
-
-                if output_format == 'plaintext':
-                    result_lines.extend([f'--- File: {rel_path} ---', content, '--- End File ---', ''])
-                elif output_format == 'xml':
-                    file_ext = os.path.splitext(rel_path)[1].lstrip('.')
-                    result_lines.extend(
-                        [
-                            f'<file path="{escape_xml(rel_path)}" type="{escape_xml(file_ext)}">',
-                            escape_xml(content),
-                            '</file>',
-                        ]
-                    )
-                elif output_format == 'markdown':
-                    lang = EXT_TO_LANG.get(file_path.split('.')[-1].lower(), '')
-                    result_lines.extend([f'**File:** `{rel_path}`', f'```{lang}', content, '```', ''])
-
-            except (UnicodeDecodeError, OSError) as e:
-                print(f'Warning: Error processing file {file_path}: {e}', file=sys.stderr)
+                abs_file_path = abspath(file_path)
+                if base_prefix and abs_file_path.startswith(base_prefix):
+                    rel_path = relpath(abs_file_path, abs_base_dir)
+
+                chunk = render(rel_path, output_format, include_line_numbers, content)
+                if chunk is not None:
+                    yield chunk
+
             except Exception as e:
                 print(f'Warning: Unexpected error processing file {file_path}: {e}', file=sys.stderr)
                 traceback.print_exc()
 
         if output_format == 'xml':
-            result_lines.append('</files>')
+            yield '</files>\n'
 
     if output_format == 'xml':
-        result_lines.append('</context>')
-    return '\n'.join(result_lines)
+        yield '</context>\n'
+
+
+def generate_output(
+    file_paths: list[str],
+    output_format: str,
+    include_line_numbers: bool,
+    include_project_tree: bool,
+    base_dir: Optional[str],
+    ignore_hidden: bool = True,
+    gitignore_rules: Optional[CompiledGitignore] = None,
+    custom_instructions: str = '',
+) -> str:
+    """Generates the final context string."""
+    buf = io.StringIO()
+    buf.writelines(
+        _iter_output(
+            file_paths,
+            output_format,
+            include_line_numbers,
+            include_project_tree,
+            base_dir,
+            ignore_hidden,
+            gitignore_rules,
+            custom_instructions,
+        )
+    )
+    return buf.getvalue()